@@ -2,6 +2,8 @@
 # Licensed under the MIT License
 """A module containing the build_mixed_context method definition."""
 
+from itertools import accumulate
+
 import pandas as pd
 
 import graphrag.index.graph.extractors.community_reports.schemas as schemas
@@ -19,6 +21,29 @@ def build_mixed_context(context: list[dict], max_tokens: int) -> str:
         context, key=lambda x: x[schemas.CONTEXT_SIZE], reverse=True
     )
 
+    # index each sub-community's report and local context once, by position in the sorted order
+    sub_community_reports = [
+        {
+            schemas.COMMUNITY_ID: sub_community_context[schemas.SUB_COMMUNITY],
+            schemas.FULL_CONTENT: sub_community_context[schemas.FULL_CONTENT],
+        }
+        for sub_community_context in sorted_context
+    ]
+    local_contexts = [
+        record
+        for sub_community_context in sorted_context
+        for record in sub_community_context[schemas.ALL_CONTEXT]
+    ]
+    local_context_starts = list(
+        accumulate(
+            (
+                len(sub_community_context[schemas.ALL_CONTEXT])
+                for sub_community_context in sorted_context
+            ),
+            initial=0,
+        )
+    )
+
     # replace local context with sub-community reports, starting from the biggest sub-community
     substitute_reports = []
     final_local_contexts = []
@@ -28,19 +53,14 @@ def build_mixed_context(context: list[dict], max_tokens: int) -> str:
     for idx, sub_community_context in enumerate(sorted_context):
         if exceeded_limit:
             if sub_community_context[schemas.FULL_CONTENT]:
-                substitute_reports.append({
-                    schemas.COMMUNITY_ID: sub_community_context[schemas.SUB_COMMUNITY],
-                    schemas.FULL_CONTENT: sub_community_context[schemas.FULL_CONTENT],
-                })
+                substitute_reports.append(sub_community_reports[idx])
             else:
                 # this sub-community has no report, so we will use its local context
                 final_local_contexts.extend(sub_community_context[schemas.ALL_CONTEXT])
                 continue
 
             # add local context for the remaining sub-communities
-            remaining_local_context = []
-            for rid in range(idx + 1, len(sorted_context)):
-                remaining_local_context.extend(sorted_context[rid][schemas.ALL_CONTEXT])
+            remaining_local_context = local_contexts[local_context_starts[idx + 1] :]
             new_context_string = sort_context(
                 local_context=remaining_local_context + final_local_contexts,
                 sub_community_reports=substitute_reports,
@@ -52,15 +72,9 @@ def build_mixed_context(context: list[dict], max_tokens: int) -> str:
 
     if exceeded_limit:
         # if all sub-community reports exceed the limit, we add reports until context is full
-        substitute_reports = []
-        for sub_community_context in sorted_context:
-            substitute_reports.append({
-                schemas.COMMUNITY_ID: sub_community_context[schemas.SUB_COMMUNITY],
-                schemas.FULL_CONTENT: sub_community_context[schemas.FULL_CONTENT],
-            })
-            new_context_string = pd.DataFrame(substitute_reports).to_csv(
-                index=False, sep=","
-            )
+        reports_df = pd.DataFrame(sub_community_reports)
+        for idx in range(len(sub_community_reports)):
+            new_context_string = reports_df.iloc[: idx + 1].to_csv(index=False, sep=",")
             if num_tokens(new_context_string) > max_tokens:
                 break
 
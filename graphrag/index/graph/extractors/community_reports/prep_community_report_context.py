@@ -161,15 +161,15 @@ def _get_community_df(
     community_df = join(
         invalid_communities, subcontext_selection, schemas.SUB_COMMUNITY
     )
-    community_df[schemas.ALL_CONTEXT] = community_df.apply(
-        lambda x: {
-            schemas.SUB_COMMUNITY: x[schemas.SUB_COMMUNITY],
-            schemas.ALL_CONTEXT: x[schemas.ALL_CONTEXT],
-            schemas.FULL_CONTENT: x[schemas.FULL_CONTENT],
-            schemas.CONTEXT_SIZE: x[schemas.CONTEXT_SIZE],
-        },
-        axis=1,
-    )
+    community_df[schemas.ALL_CONTEXT] = community_df.loc[
+        :,
+        [
+            schemas.SUB_COMMUNITY,
+            schemas.ALL_CONTEXT,
+            schemas.FULL_CONTENT,
+            schemas.CONTEXT_SIZE,
+        ],
+    ].to_dict("records")
     community_df = (
         community_df.groupby(schemas.NODE_COMMUNITY)
         .agg({schemas.ALL_CONTEXT: list})
@@ -2,14 +2,135 @@
 # Licensed under the MIT License
 """Sort context by degree in descending order."""
 
+import csv
+import hashlib
+import io
+import math
+import os
+import re
+from functools import cache, lru_cache
+from itertools import chain
+from typing import Any
+
+import numpy as np
 import pandas as pd
 
 import graphrag.index.graph.extractors.community_reports.schemas as schemas
 from graphrag.query.llm.text_utils import num_tokens
 
+# characters that make the csv writer quote a field, besides the delimiter
+_QUOTED_CHARS = re.compile(r'["\r\n]')
+
+
+class _CsvSection:
+    """A titled csv table of records deduplicated by id, built one row at a time."""
+
+    def __init__(self, title: str, id_column: str):
+        self.title = title
+        self.id_column = id_column
+        self.header = ""
+        self.rows: list[str] = []
+        self._columns: list[str] = []
+        self._id_index = 0
+        self._seen: set = set()
+        self._buffer = io.StringIO()
+        # pandas' to_csv defaults, so the output matches the previous DataFrame-based rendering
+        self._writer = csv.writer(self._buffer, lineterminator=os.linesep)
+
+    def get_id(self, record: dict) -> Any:
+        """Get the id of a record, or None if it has no usable id."""
+        if not (
+            self.id_column in record
+            and record[self.id_column]
+            and str(record[self.id_column]).strip() != ""
+        ):
+            return None
+        return record[self.id_column]
+
+    def format_row(self, record: dict) -> str:
+        """Format a record as a csv row."""
+        if not self._columns:
+            # records of a section share one schema, so the first one sets the columns
+            self._columns = list(record.keys())
+            self._id_index = self._columns.index(self.id_column)
+            self.header = self._write(self._columns)
+        fields = [_csv_field(record.get(column)) for column in self._columns]
+        # pandas writes a float id column as int
+        if isinstance(record[self.id_column], float):
+            fields[self._id_index] = str(int(record[self.id_column]))
+        row = ",".join(fields)
+        if row and row.count(",") == len(fields) - 1 and not _QUOTED_CHARS.search(row):
+            # no field needs quoting, so the joined fields are the csv row
+            return row + os.linesep
+        return self._write(fields)
+
+    def is_new(self, record_id: Any) -> bool:
+        """Check whether a record with this id has not been added yet."""
+        return record_id not in self._seen
+
+    def add(self, record_id: Any, row: str) -> None:
+        """Add a formatted row to the section."""
+        self._seen.add(record_id)
+        self.rows.append(row)
+
+    def to_string(self, num_rows: int | None = None) -> str:
+        """Render the section with its first `num_rows` rows, or an empty string if there are none."""
+        rows = self.rows[:num_rows]
+        if not rows:
+            return ""
+        return f"{self.title}\n{self.header}{''.join(rows)}"
+
+    def _write(self, values: list) -> str:
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        self._writer.writerow(values)
+        return self._buffer.getvalue()
+
+
+def _csv_field(value: Any) -> str:
+    """Format a value the way pandas writes it, with missing values left blank."""
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return ""
+    if isinstance(value, float):
+        return repr(float(value))
+    return str(value)
+
+
+@lru_cache(maxsize=16384)
+def _num_row_tokens(row: str) -> int:
+    """Count the tokens of a csv row; the same rows come up again across calls on overlapping contexts."""
+    return num_tokens(row)
+
+
+def _fits_by_size(text: str, max_tokens: int) -> bool:
+    """Check whether text certainly fits the token limit without tokenizing it.
+
+    Every token spans at least one utf-8 byte, so text with no more bytes than max_tokens always fits.
+    """
+    return len(text) <= max_tokens and len(text.encode()) <= max_tokens
+
+
+# number of sorted edges kept when trimming recent contexts, keyed by a digest of their content
+_MAX_CUT_OFFS = 16384
+_cut_offs: dict[bytes, int] = {}
+
+
+def _get_cut_off_key(
+    sections: list[_CsvSection], section_sizes: np.ndarray, max_tokens: int
+) -> bytes:
+    """Digest everything the trimmed context depends on: the rows, which edge added them and the token limit."""
+    digest = hashlib.blake2b(str(max_tokens).encode(), digest_size=16)
+    digest.update(section_sizes.tobytes())
+    for section in sections:
+        digest.update(section.header.encode())
+        # row lengths keep the row boundaries unambiguous
+        digest.update(np.array([len(row) for row in section.rows]).tobytes())
+        digest.update("".join(section.rows).encode())
+    return digest.digest()
+
 
 def sort_context(
-    local_context: list[dict],
+    local_context: list[dict] | pd.DataFrame,
     sub_community_reports: list[dict] | None = None,
     max_tokens: int | None = None,
     node_id_column: str = schemas.NODE_ID,
@@ -27,130 +148,182 @@ def sort_context(
     """Sort context by degree in descending order.
 
     If max tokens is provided, we will return the context string that fits within the token limit.
+    The local context can be given as a list of node records or as a DataFrame with the same columns.
+
+    The node, edge, claim and report detail records of each kind must share one schema: each
+    table takes its columns from the first record added to it, so keys missing from a later
+    record are left blank and extra keys are dropped. Missing values are written blank without
+    turning an int column into floats.
     """
+    # sort node details by degree in descending order
+    edges = []
+    node_details = {}
+    claim_details = {}
 
-    def _get_context_string(
-        entities: list[dict],
-        edges: list[dict],
-        claims: list[dict],
-        sub_community_reports: list[dict] | None = None,
-    ) -> str:
-        """Concatenate structured data into a context string."""
-        contexts = []
-        if sub_community_reports:
-            sub_community_reports = [
-                report
-                for report in sub_community_reports
-                if community_id_column in report
-                and report[community_id_column]
-                and str(report[community_id_column]).strip() != ""
+    if isinstance(local_context, pd.DataFrame):
+        node_names = local_context[node_name_column].to_numpy()
+        node_details = dict(
+            zip(node_names, local_context[node_details_column], strict=True)
+        )
+        if edge_details_column in local_context:
+            edges = [
+                e
+                for e in chain.from_iterable(
+                    local_context[edge_details_column].dropna()
+                )
+                if isinstance(e, dict)
             ]
-            report_df = pd.DataFrame(sub_community_reports).drop_duplicates()
-            if not report_df.empty:
-                if report_df[community_id_column].dtype == float:
-                    report_df[community_id_column] = report_df[
-                        community_id_column
-                    ].astype(int)
-                report_string = (
-                    f"----Reports-----\n{report_df.to_csv(index=False, sep=',')}"
+        if claim_details_column in local_context:
+            claim_details = {
+                node_name: [c for c in record_claims if isinstance(c, dict)]
+                for node_name, record_claims in zip(
+                    node_names, local_context[claim_details_column], strict=True
                 )
-                contexts.append(report_string)
-
-        entities = [
-            entity
-            for entity in entities
-            if node_id_column in entity
-            and entity[node_id_column]
-            and str(entity[node_id_column]).strip() != ""
-        ]
-        entity_df = pd.DataFrame(entities).drop_duplicates()
-        if not entity_df.empty:
-            if entity_df[node_id_column].dtype == float:
-                entity_df[node_id_column] = entity_df[node_id_column].astype(int)
-            entity_string = (
-                f"-----Entities-----\n{entity_df.to_csv(index=False, sep=',')}"
+                if isinstance(record_claims, list | np.ndarray)
+            }
+    else:
+        for record in local_context:
+            node_name = record[node_name_column]
+            edges.extend(
+                e for e in record.get(edge_details_column, []) if isinstance(e, dict)
             )
-            contexts.append(entity_string)
-
-        if claims and len(claims) > 0:
-            claims = [
-                claim
-                for claim in claims
-                if claim_id_column in claim
-                and claim[claim_id_column]
-                and str(claim[claim_id_column]).strip() != ""
+            node_details[node_name] = record[node_details_column]
+            claim_details[node_name] = [
+                c for c in record.get(claim_details_column, []) if isinstance(c, dict)
             ]
-            claim_df = pd.DataFrame(claims).drop_duplicates()
-            if not claim_df.empty:
-                if claim_df[claim_id_column].dtype == float:
-                    claim_df[claim_id_column] = claim_df[claim_id_column].astype(int)
-                claim_string = (
-                    f"-----Claims-----\n{claim_df.to_csv(index=False, sep=',')}"
-                )
-                contexts.append(claim_string)
-
-        edges = [
-            edge
-            for edge in edges
-            if edge_id_column in edge
-            and edge[edge_id_column]
-            and str(edge[edge_id_column]).strip() != ""
+
+    degrees = np.fromiter(
+        (edge[edge_degree_column] for edge in edges), dtype=float, count=len(edges)
+    )
+    edges = [edges[i] for i in np.argsort(-degrees, kind="stable")]
+
+    # sections in the order they appear in the context string
+    reports = _CsvSection("----Reports-----", community_id_column)
+    entities = _CsvSection("-----Entities-----", node_id_column)
+    claims = _CsvSection("-----Claims-----", claim_id_column)
+    relationships = _CsvSection("-----Relationships-----", edge_id_column)
+    sections = [reports, entities, claims, relationships]
+
+    for report in sub_community_reports or []:
+        report_id = reports.get_id(report)
+        if report_id is not None and reports.is_new(report_id):
+            reports.add(report_id, reports.format_row(report))
+
+    seen_node_names = set()
+
+    def _add_edge(edge: dict) -> list[str]:
+        """Add the edge with its nodes and claims to the sections, returning the new csv rows."""
+        # nodes and their claims are only looked up the first time their name comes up
+        new_node_names = [
+            name
+            for name in dict.fromkeys((
+                edge[edge_source_column],
+                edge[edge_target_column],
+            ))
+            if name not in seen_node_names
+        ]
+        seen_node_names.update(new_node_names)
+        candidates = [
+            *((entities, node_details.get(name, {})) for name in new_node_names),
+            *(
+                (claims, claim)
+                for name in new_node_names
+                for claim in claim_details.get(name, [])
+            ),
+            (relationships, edge),
         ]
-        edge_df = pd.DataFrame(edges).drop_duplicates()
-        if not edge_df.empty:
-            if edge_df[edge_id_column].dtype == float:
-                edge_df[edge_id_column] = edge_df[edge_id_column].astype(int)
-            edge_string = (
-                f"-----Relationships-----\n{edge_df.to_csv(index=False, sep=',')}"
+        new_rows = []
+        for section, record in candidates:
+            record_id = section.get_id(record)
+            if record_id is not None and section.is_new(record_id):
+                row = section.format_row(record)
+                section.add(record_id, row)
+                new_rows.append(row)
+        return new_rows
+
+    # number of rows in each section after adding the first n edges
+    section_sizes = np.zeros((len(edges) + 1, len(sections)), dtype=np.int64)
+    section_sizes[0] = [len(section.rows) for section in sections]
+
+    def _get_context_string(num_edges: int) -> str:
+        """Concatenate the sections for the first `num_edges` sorted edges into a context string."""
+        contexts = [
+            section.to_string(num_rows)
+            for section, num_rows in zip(
+                sections, section_sizes[num_edges], strict=True
             )
-            contexts.append(edge_string)
+        ]
+        return "\n\n".join(context for context in contexts if context)
 
-        return "\n\n".join(contexts)
+    # new csv rows per edge, in sorted edge order
+    edge_rows = []
+    for num_edges, edge in enumerate(edges, start=1):
+        edge_rows.append(_add_edge(edge))
+        section_sizes[num_edges] = [len(section.rows) for section in sections]
 
-    # sort node details by degree in descending order
-    edges = []
-    node_details = {}
-    claim_details = {}
+    context_string = _get_context_string(len(edges))
+    if not max_tokens or _fits_by_size(context_string, max_tokens):
+        return context_string
 
-    for record in local_context:
-        node_name = record[node_name_column]
-        record_edges = record.get(edge_details_column, [])
-        record_edges = [e for e in record_edges if not pd.isna(e)]
-        record_node_details = record[node_details_column]
-        record_claims = record.get(claim_details_column, [])
-        record_claims = [c for c in record_claims if not pd.isna(c)]
-
-        edges.extend(record_edges)
-        node_details[node_name] = record_node_details
-        claim_details[node_name] = record_claims
-
-    edges = [edge for edge in edges if isinstance(edge, dict)]
-    edges = sorted(edges, key=lambda x: x[edge_degree_column], reverse=True)
-
-    sorted_edges = []
-    sorted_nodes = []
-    sorted_claims = []
-    context_string = ""
-    for edge in edges:
-        source_details = node_details.get(edge[edge_source_column], {})
-        target_details = node_details.get(edge[edge_target_column], {})
-        sorted_nodes.extend([source_details, target_details])
-        sorted_edges.append(edge)
-        source_claims = claim_details.get(edge[edge_source_column], [])
-        target_claims = claim_details.get(edge[edge_target_column], [])
-        sorted_claims.extend(source_claims if source_claims else [])
-        sorted_claims.extend(target_claims if source_claims else [])
-        if max_tokens:
-            new_context_string = _get_context_string(
-                sorted_nodes, sorted_edges, sorted_claims, sub_community_reports
-            )
-            if num_tokens(new_context_string) > max_tokens:
-                break
-            context_string = new_context_string
+    cut_off_key = _get_cut_off_key(sections, section_sizes, max_tokens)
+    if cut_off_key in _cut_offs:
+        return _get_context_string(_cut_offs[cut_off_key])
+
+    # estimate the cut-off from the cumulative token cost of each edge: the section headings it
+    # opens plus its new csv rows. Rows are tokenized in doubling blocks of edges, so only the
+    # rows up to about the cut-off get tokenized.
+    opened_sections = (section_sizes[:-1] == 0) & (section_sizes[1:] > 0)
+    heading_tokens = np.array([
+        # the section title, csv header and the separator from the previous section
+        _num_row_tokens(f"\n\n{section.title}\n{section.header}") if section.rows else 0
+        for section in sections
+    ])
+    edge_tokens = opened_sections @ heading_tokens
+    budget = max_tokens - num_tokens(_get_context_string(0))
+    num_edges = 0
+    block_size = 16
+    while num_edges < len(edges):
+        block = range(num_edges, min(num_edges + block_size, len(edges)))
+        block_tokens = np.cumsum([
+            edge_tokens[i] + sum(_num_row_tokens(row) for row in edge_rows[i])
+            for i in block
+        ])
+        num_fitting = int(np.searchsorted(block_tokens, budget, side="right"))
+        num_edges += num_fitting
+        if num_fitting < len(block):
+            break
+        budget -= block_tokens[-1]
+        block_size *= 2
 
-    if context_string == "":
-        return _get_context_string(
-            sorted_nodes, sorted_edges, sorted_claims, sub_community_reports
+    @cache
+    def _fits(num_edges: int) -> bool:
+        context_string = _get_context_string(num_edges)
+        return (
+            _fits_by_size(context_string, max_tokens)
+            or num_tokens(context_string) <= max_tokens
         )
 
-    return context_string
+    # the running count is an estimate, so settle the cut-off on the exact token count:
+    # gallop away from the estimate to bracket it, then binary search the bracket
+    lower, upper = num_edges, num_edges + 1
+    step = 1
+    while upper <= len(edges) and _fits(upper):
+        lower, step = upper, step * 2
+        upper = min(lower + step, len(edges) + 1)
+    step = 1
+    while lower > 0 and not _fits(lower):
+        upper, step = lower, step * 2
+        lower = max(upper - step, 0)
+    while upper - lower > 1:
+        middle = (lower + upper) // 2
+        if _fits(middle):
+            lower = middle
+        else:
+            upper = middle
+
+    # if not even the first edge fits, return its context rather than an empty one
+    num_edges = max(lower, min(1, len(edges)))
+    if len(_cut_offs) >= _MAX_CUT_OFFS:
+        del _cut_offs[next(iter(_cut_offs))]
+    _cut_offs[cut_off_key] = num_edges
+    return _get_context_string(num_edges)
@@ -134,18 +134,19 @@ def _prepare_reports_at_level(
     )
 
     # concat all node details, including name, degree, node_details, edge_details, and claim_details
-    merged_node_df[schemas.ALL_CONTEXT] = merged_node_df.apply(
-        lambda x: {
-            node_name_column: x[node_name_column],
-            node_degree_column: x[node_degree_column],
-            node_details_column: x[node_details_column],
-            edge_details_column: x[edge_details_column],
-            claim_details_column: x[claim_details_column]
+    # iterate plain records: apply(axis=1) would box every row into a Series
+    merged_node_df[schemas.ALL_CONTEXT] = [
+        {
+            node_name_column: record[node_name_column],
+            node_degree_column: record[node_degree_column],
+            node_details_column: record[node_details_column],
+            edge_details_column: record[edge_details_column],
+            claim_details_column: record[claim_details_column]
             if level_claim_df is not None
             else [],
-        },
-        axis=1,
-    )
+        }
+        for record in merged_node_df.to_dict("records")
+    ]
 
     # group all node details by community
     community_df = (
@@ -153,9 +154,9 @@ def _prepare_reports_at_level(
         .agg({schemas.ALL_CONTEXT: list})
         .reset_index()
     )
-    community_df[schemas.CONTEXT_STRING] = community_df[schemas.ALL_CONTEXT].apply(
-        lambda x: sort_context(
-            x,
+    community_df[schemas.CONTEXT_STRING] = [
+        sort_context(
+            context,
             node_id_column=node_id_column,
             node_name_column=node_name_column,
             node_details_column=node_details_column,
@@ -168,7 +169,8 @@ def _prepare_reports_at_level(
             claim_details_column=claim_details_column,
             community_id_column=community_id_column,
         )
-    )
+        for context in community_df[schemas.ALL_CONTEXT]
+    ]
     set_context_size(community_df)
     set_context_exceeds_flag(community_df, max_tokens)
 
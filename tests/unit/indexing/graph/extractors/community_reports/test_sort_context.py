@@ -1,11 +1,20 @@
 # Copyright (c) 2024 Microsoft Corporation.
 # Licensed under the MIT License
+import importlib
 import math
 import platform
 
+import pandas as pd
+import pytest
+
 from graphrag.index.graph.extractors.community_reports import sort_context
 from graphrag.query.llm.text_utils import num_tokens
 
+# the package re-exports the function under the module's name
+sort_context_module = importlib.import_module(
+    "graphrag.index.graph.extractors.community_reports.sort_context"
+)
+
 nan = math.nan
 
 context: list[dict] = [
@@ -215,3 +224,172 @@ def test_sort_context_max_tokens():
     assert ctx is not None, "Context is none"
     num = num_tokens(ctx)
     assert num <= 800, f"num_tokens is not less than or equal to 800: {num}"
+
+
+def test_sort_context_dataframe():
+    ctx = sort_context(pd.DataFrame(context))
+    assert ctx == sort_context(context), "DataFrame context does not match list context"
+
+
+def test_sort_context_includes_target_claims():
+    claim_context = [
+        {
+            "title": "SCROOGE",
+            "degree": 1,
+            "node_details": {
+                "human_readable_id": 1,
+                "title": "SCROOGE",
+                "description": "A miserly old man",
+                "degree": 1,
+            },
+            "edge_details": [
+                {
+                    "human_readable_id": 1,
+                    "source": "SCROOGE",
+                    "target": "MARLEY",
+                    "description": "Marley was Scrooge's business partner",
+                    "combined_degree": 2,
+                },
+            ],
+            "claim_details": [nan],
+        },
+        {
+            "title": "MARLEY",
+            "degree": 1,
+            "node_details": {
+                "human_readable_id": 2,
+                "title": "MARLEY",
+                "description": "Scrooge's late business partner",
+                "degree": 1,
+            },
+            "edge_details": [nan],
+            "claim_details": [
+                {
+                    "human_readable_id": 3,
+                    "subject_id": "MARLEY",
+                    "type": "DEATH",
+                    "status": "TRUE",
+                    "description": "Marley was dead to begin with",
+                },
+            ],
+        },
+    ]
+    ctx = sort_context(claim_context)
+    assert "-----Claims-----" in ctx, "Target node claims are missing"
+    assert "Marley was dead to begin with" in ctx
+
+
+class _WordCounter:
+    """Deterministic offline stand-in for num_tokens that records its calls."""
+
+    def __init__(self):
+        self.calls = 0
+        # any mode but "words" makes the running estimate of the cut-off too low ("distinct")
+        # or too high ("surcharge"), so the exact search has to move away from it
+        self.mode = "words"
+
+    def __call__(self, text: str) -> int:
+        self.calls += 1
+        words = text.split()
+        if self.mode == "distinct":
+            return len(set(words))
+        if self.mode == "surcharge":
+            return len(words) + len(words) // 10
+        return len(words)
+
+
+def _clear_memos():
+    """Forget cut-offs and row token counts memoized by earlier calls."""
+    sort_context_module._cut_offs.clear()  # noqa: SLF001
+    sort_context_module._num_row_tokens.cache_clear()  # noqa: SLF001
+
+
+@pytest.fixture
+def word_counter(monkeypatch):
+    counter = _WordCounter()
+    monkeypatch.setattr(sort_context_module, "num_tokens", counter)
+    _clear_memos()
+    yield counter
+    _clear_memos()
+
+
+def _chain_context(num_edges: int = 10) -> list[dict]:
+    """Nodes N0..Nn joined in a chain, each edge stored once and with a distinct degree."""
+    return [
+        {
+            "title": f"N{i}",
+            "degree": 2,
+            "node_details": {
+                "human_readable_id": i,
+                "title": f"N{i}",
+                "description": " ".join(["node"] * (i + 1)),
+                "degree": 2,
+            },
+            "edge_details": [
+                {
+                    "human_readable_id": 100 + i,
+                    "source": f"N{i}",
+                    "target": f"N{i + 1}",
+                    "description": " ".join(["edge"] * (3 * i + 1)),
+                    "combined_degree": num_edges - i,
+                }
+            ]
+            if i < num_edges
+            else [nan],
+            "claim_details": [nan],
+        }
+        for i in range(num_edges + 1)
+    ]
+
+
+def _prefix_context(context: list[dict], num_edges: int) -> str:
+    """The untrimmed context string of only the `num_edges` highest degree edges."""
+    return sort_context([
+        {
+            **record,
+            "edge_details": [
+                edge
+                for edge in record["edge_details"]
+                if isinstance(edge, dict)
+                and edge["human_readable_id"] < 100 + num_edges
+            ],
+        }
+        for record in context
+    ])
+
+
+@pytest.mark.parametrize("mode", ["words", "distinct", "surcharge"])
+def test_sort_context_trims_to_largest_fitting_prefix(word_counter, mode):
+    word_counter.mode = mode
+    chain = _chain_context()
+    prefixes = [_prefix_context(chain, n) for n in range(1, 11)]
+    prefix_tokens = [word_counter(prefix) for prefix in prefixes]
+    for max_tokens in range(prefix_tokens[0], prefix_tokens[-1] + 1):
+        num_fitting = sum(tokens <= max_tokens for tokens in prefix_tokens)
+        ctx = sort_context(chain, max_tokens=max_tokens)
+        assert ctx == prefixes[num_fitting - 1], f"Wrong cut-off for {max_tokens}"
+
+
+def test_sort_context_fits_by_size_without_tokenizing(word_counter):
+    chain = _chain_context()
+    full = sort_context(chain)
+    word_counter.calls = 0
+    assert sort_context(chain, max_tokens=len(full.encode())) == full
+    assert word_counter.calls == 0, "Tokenized a context that fits by size"
+
+
+def test_sort_context_repeated_call_uses_cut_off(word_counter):
+    chain = _chain_context()
+    expected = _prefix_context(chain, 3)
+    max_tokens = len(expected.split())
+    ctx = sort_context(chain, max_tokens=max_tokens)
+    assert ctx == expected
+    word_counter.calls = 0
+    assert sort_context(chain, max_tokens=max_tokens) == ctx
+    assert word_counter.calls == 0, "Repeated call tokenized the context again"
+
+
+def test_sort_context_first_edge_overflows(word_counter):
+    chain = _chain_context()
+    ctx = sort_context(chain, max_tokens=1)
+    assert ctx == _prefix_context(chain, 1), "First edge context not returned"